@@ -21,15 +21,16 @@ import os
 import shutil
 import sys
 import tarfile
-from email.utils import parsedate
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
 
 import py
 import requests
-from dateutil import tz
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 
 from . import path
-from .components import QuestionAnswerer
-from .components._config import get_app_namespace
 from .constants import BLUEPRINTS_URL
 from .exceptions import ElasticsearchKnowledgeBaseConnectionError
 
@@ -40,6 +41,37 @@ BLUEPRINT_URL = "{mindmeld_url}/{blueprint}/{filename}"
 
 BLUEPRINT_APP_ARCHIVE = "app.tar.gz"
 BLUEPRINT_KB_ARCHIVE = "kb.tar.gz"
+KB_LOAD_WORKERS = 4
+
+# tarfile copies members with a 16 KiB buffer by default, which means a lot of small
+# reads and writes for multi-megabyte archives
+ARCHIVE_BUFFER_SIZE = 1 << 20
+
+DOWNLOAD_ATTEMPTS = 3
+
+
+class _IncompleteDownloadError(IOError):
+    """Raised when a connection closes before the whole archive has been received."""
+
+
+# Network errors that cut a download off part way through. Local file system errors and
+# corrupt archives are not retried.
+_DOWNLOAD_ERRORS = (
+    requests.RequestException,
+    Urllib3HTTPError,
+    _IncompleteDownloadError,
+)
+
+# Blueprint archives are all served from the same host, so share the connection pool
+# to reuse open TLS connections across requests and threads
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Maps a remote archive url to its last modified time and when that was checked, so
+# repeated fetches within a short window don't need another round trip
+LAST_MODIFIED_CACHE_TTL = 60
+_LAST_MODIFIED_CACHE = {}
+
 BLUEPRINTS = {
     "kwik_e_mart": {},
     "food_ordering": {},
@@ -50,6 +82,7 @@ BLUEPRINTS = {
     "banking_assistant": {},
     "screening_app": {},
 }
+_BLUEPRINT_NAMES = frozenset(BLUEPRINTS)
 
 
 class Blueprint:
@@ -94,13 +127,33 @@ class Blueprint:
         Raises:
             ValueError: When an unknown blueprint is specified.
         """
-        if name not in BLUEPRINTS:
-            raise ValueError("Unknown blueprint name: {!r}".format(name))
+        _validate_blueprint_name(name)
         bp_config = BLUEPRINTS[name]
+        app_path = self._get_app_path(name, app_path)
+        with_kb = bp_config.get("kb", True) and not skip_kb
+
+        # The app and kb archives are independent downloads, so fetch and extract them
+        # concurrently
+        extract_dirs = {"app": app_path}
+        if with_kb:
+            extract_dirs["kb"] = self._get_kb_dir(name)
+        with ThreadPoolExecutor(max_workers=len(extract_dirs)) as executor:
+            futures = {
+                archive_type: executor.submit(
+                    self._fetch_archive, name, archive_type, extract_dir
+                )
+                for archive_type, extract_dir in extract_dirs.items()
+            }
 
-        app_path = self.setup_app(name, app_path)
-        if bp_config.get("kb", True) and not skip_kb:
-            self.setup_kb(name, app_path, es_host=es_host)
+        futures["app"].result()
+        logger.info("Created %r app at %r", name, app_path)
+        if with_kb:
+            try:
+                futures["kb"].result()
+            except ValueError:
+                logger.warning("No knowledge base to set up.")
+                return app_path
+            self._load_kb(name, app_path, es_host)
         return app_path
 
     @classmethod
@@ -114,15 +167,10 @@ class Blueprint:
         Raises:
             ValueError: When an unknown blueprint is specified
         """
-        if name not in BLUEPRINTS:
-            raise ValueError("Unknown blueprint name: {!r}".format(name))
+        _validate_blueprint_name(name)
 
-        app_path = app_path or os.path.join(os.getcwd(), name)
-        app_path = os.path.abspath(app_path)
-
-        local_archive = cls._fetch_archive(name, "app")
-        tarball = tarfile.open(local_archive)
-        tarball.extractall(path=app_path)
+        app_path = cls._get_app_path(name, app_path)
+        cls._fetch_archive(name, "app", app_path)
         logger.info("Created %r app at %r", name, app_path)
         return app_path
 
@@ -142,58 +190,94 @@ class Blueprint:
                 or in the environment.
             ValueError: When an unknown blueprint is specified.
         """
-        if name not in BLUEPRINTS:
-            raise ValueError("Unknown blueprint name: {!r}".format(name))
+        _validate_blueprint_name(name)
 
-        app_path = app_path or os.path.join(os.getcwd(), name)
-        app_path = os.path.abspath(app_path)
-        app_namespace = get_app_namespace(app_path)
-        es_host = es_host or os.environ.get("MM_ES_HOST", "localhost")
-        cache_dir = path.get_cached_blueprint_path(name)
+        app_path = cls._get_app_path(name, app_path)
         try:
-            local_archive = cls._fetch_archive(name, "kb")
+            cls._fetch_archive(name, "kb", cls._get_kb_dir(name))
         except ValueError:
             logger.warning("No knowledge base to set up.")
             return
+        cls._load_kb(name, app_path, es_host)
 
-        kb_dir = os.path.join(cache_dir, "kb")
-        tarball = tarfile.open(local_archive)
-        tarball.extractall(path=kb_dir)
+    @classmethod
+    def _load_kb(cls, name, app_path, es_host=None):
+        """Loads the extracted knowledge base indices of the specified blueprint into
+        Elasticsearch and copies them into the app's data directory.
 
-        _, _, index_files = next(os.walk(kb_dir))
+        Args:
+            name (str): The name of the blueprint
+            app_path (str): The absolute path to the app
+            es_host (str, optional): The hostname of the elasticsearch cluster
+                for the knowledge base. If no value is passed, value will be
+                read from the environment.
+        """
+        # The components package pulls in Elasticsearch and the ML stack, so only import
+        # it once a knowledge base is actually being set up
+        # pylint: disable=import-outside-toplevel
+        from .components import QuestionAnswerer
+        from .components._config import get_app_namespace
+        from .components._elasticsearch_helpers import create_es_client
+
+        app_namespace = get_app_namespace(app_path)
+        es_host = es_host or os.environ.get("MM_ES_HOST", "localhost")
+        # share one client, and so one connection pool, across all of the index uploads
+        es_client = create_es_client(es_host)
+        kb_dir = cls._get_kb_dir(name)
+
+        with os.scandir(kb_dir) as entries:
+            index_files = [entry.name for entry in entries if entry.is_file()]
 
         data_dir = os.path.join(app_path, "data")
         if not os.path.exists(data_dir):
             os.makedirs(data_dir)
 
-        for index in index_files:
+        def _load_index(index):
             index_name, _ = os.path.splitext(index)
             data_file = os.path.join(kb_dir, index)
 
             # Copy the index files into the app's data directory
             shutil.copy2(data_file, data_dir)
 
-            try:
-                QuestionAnswerer.load_kb(app_namespace, index_name, data_file, es_host)
-            except ElasticsearchKnowledgeBaseConnectionError as ex:
-                logger.error(
-                    "Cannot set up knowledge base. Unable to connect to Elasticsearch "
-                    "instance at %r. Confirm it is running or specify an alternate "
-                    "instance with the MM_ES_HOST environment variable",
-                    es_host,
-                )
+            QuestionAnswerer.load_kb(
+                app_namespace, index_name, data_file, es_host, es_client=es_client
+            )
 
-                raise ex
+        # Each index is independent, so copy and upload them to Elasticsearch concurrently
+        try:
+            with ThreadPoolExecutor(max_workers=KB_LOAD_WORKERS) as executor:
+                # consume the results so that any exception is raised here
+                list(executor.map(_load_index, index_files))
+        except ElasticsearchKnowledgeBaseConnectionError as ex:
+            logger.error(
+                "Cannot set up knowledge base. Unable to connect to Elasticsearch "
+                "instance at %r. Confirm it is running or specify an alternate "
+                "instance with the MM_ES_HOST environment variable",
+                es_host,
+            )
+
+            raise ex
 
         logger.info("Created %r knowledge base at %r", name, es_host)
 
     @staticmethod
-    def _fetch_archive(name, archive_type):
+    def _get_app_path(name, app_path=None):
+        app_path = app_path or os.path.join(os.getcwd(), name)
+        return os.path.abspath(app_path)
+
+    @staticmethod
+    def _get_kb_dir(name):
+        return os.path.join(path.get_cached_blueprint_path(name), "kb")
+
+    @staticmethod
+    def _fetch_archive(name, archive_type, extract_dir=None):
         """Fetches a blueprint archive from S3.
 
         Args:
             name (str): The name of the blueprint.
             archive_type (str): The type or the archive. Can be 'app' or 'kb'.
+            extract_dir (str, optional): A directory to extract the archive into. A freshly
+                downloaded archive is extracted while it is streamed to the local cache.
 
         Returns:
             str: The path of the local archive after it is downloaded.
@@ -217,45 +301,198 @@ class Blueprint:
             mindmeld_url=BLUEPRINTS_URL, blueprint=name, filename=filename
         )
 
-        res = requests.head(remote_url)
-        if res.status_code == 401:
-            # authentication error
-            msg = (
-                "Invalid MindMeld credentials. Cannot download blueprint. Please confirm "
-                "they are correct and try again."
-            )
-            logger.error(msg)
-            raise EnvironmentError(msg)
-        if res.status_code != 200:
-            # Unknown error
-            msg = "Unknown error fetching {} archive from {!r}".format(
-                archive_type, remote_url
-            )
-            logger.warning(msg)
-            raise ValueError("Unknown error fetching archive")
-        remote_modified = datetime.datetime(
-            *parsedate(res.headers.get("last-modified"))[:6], tzinfo=tz.tzutc()
-        )
         try:
-            local_modified = datetime.datetime.fromtimestamp(
-                os.path.getmtime(local_archive), tz.tzlocal()
-            )
+            local_mtime = os.path.getmtime(local_archive)
         except (OSError, IOError):
-            # File doesn't exist, use minimum possible time
-            local_modified = datetime.datetime(
-                datetime.MINYEAR, 1, 1, tzinfo=tz.tzutc()
+            # File doesn't exist, the archive must be downloaded
+            local_mtime = None
+
+        headers = {}
+        if local_mtime is not None:
+            cached = _LAST_MODIFIED_CACHE.get(remote_url)
+            if cached and time.monotonic() - cached[1] < LAST_MODIFIED_CACHE_TTL:
+                local_modified = datetime.datetime.fromtimestamp(
+                    local_mtime, datetime.timezone.utc
+                )
+                if cached[0] < local_modified:
+                    logger.info("Using cached %r %s archive", name, archive_type)
+                    if extract_dir:
+                        _extract_archive(local_archive, extract_dir)
+                    return local_archive
+            headers["If-Modified-Since"] = formatdate(local_mtime, usegmt=True)
+
+        # A conditional request lets the server answer a fresh cache with a bodiless 304
+        # and an outdated one with the new archive in a single round trip
+        with _SESSION.get(remote_url, headers=headers, stream=True) as res:
+            if res.status_code == 401:
+                # authentication error
+                msg = (
+                    "Invalid MindMeld credentials. Cannot download blueprint. Please confirm "
+                    "they are correct and try again."
+                )
+                logger.error(msg)
+                raise EnvironmentError(msg)
+            if res.status_code == 304:
+                logger.info("Using cached %r %s archive", name, archive_type)
+                if extract_dir:
+                    _extract_archive(local_archive, extract_dir)
+            elif res.status_code != 200:
+                # Unknown error
+                logger.warning(
+                    "Unknown error fetching %s archive from %r",
+                    archive_type,
+                    remote_url,
+                )
+                raise ValueError("Unknown error fetching archive")
+            else:
+                logger.info("Fetching %s archive from %r", archive_type, remote_url)
+                _download_archive(res, remote_url, local_archive, extract_dir)
+
+            last_modified = res.headers.get("last-modified")
+            if last_modified:
+                remote_modified = parsedate_to_datetime(last_modified)
+                if remote_modified.tzinfo is None:
+                    # a '-0000' offset parses as a naive datetime, but HTTP dates are UTC
+                    remote_modified = remote_modified.replace(
+                        tzinfo=datetime.timezone.utc
+                    )
+                _LAST_MODIFIED_CACHE[remote_url] = (remote_modified, time.monotonic())
+        return local_archive
+
+
+class _TeeReader:
+    """A read-only file-like object which writes everything read from a source stream to
+    a sink file. Running out of data before the expected size raises an
+    ``_IncompleteDownloadError``, since a connection closed early can otherwise look
+    like a complete archive to tarfile.
+    """
+
+    def __init__(self, source, sink, expected_size=None):
+        self._source = source
+        self._sink = sink
+        self._expected_size = expected_size
+        self._read_size = 0
+
+    def read(self, size=None):
+        data = self._source.read(size)
+        if not data and size != 0 and self._read_size < (self._expected_size or 0):
+            raise _IncompleteDownloadError(
+                "Connection closed after {} of {} bytes".format(
+                    self._read_size, self._expected_size
+                )
             )
+        self._read_size += len(data)
+        self._sink.write(data)
+        return data
 
-        if remote_modified < local_modified:
-            logger.info("Using cached %r %s archive", name, archive_type)
-        else:
-            logger.info("Fetching %s archive from %r", archive_type, remote_url)
-            res = requests.get(remote_url, stream=True)
-            if res.status_code == 200:
-                with open(local_archive, "wb") as file_pointer:
-                    res.raw.decode_content = True
-                    shutil.copyfileobj(res.raw, file_pointer)
-        return local_archive
+
+def _download_archive(response, url, local_archive, extract_dir=None):
+    """Downloads a blueprint archive from a streamed response into the local cache. The
+    archive is written to a partial file first, and an interrupted download is resumed
+    with a range request instead of starting over.
+
+    Args:
+        response (requests.Response): The streamed response for the archive.
+        url (str): The url of the remote archive.
+        local_archive (str): The path to store the archive at.
+        extract_dir (str, optional): A directory to extract the archive into while it is
+            downloaded.
+    """
+    partial_archive = local_archive + ".part"
+    # only resume from the same version of the archive, otherwise the server sends it whole
+    validator = response.headers.get("etag") or response.headers.get("last-modified")
+    expected_size = None
+    offset = 0
+    extracted = False
+    try:
+        for attempt in range(DOWNLOAD_ATTEMPTS):
+            try:
+                if attempt:
+                    time.sleep(2 ** (attempt - 1))
+                    headers = {"Range": "bytes={}-".format(offset)}
+                    if validator:
+                        headers["If-Range"] = validator
+                    response = _SESSION.get(url, headers=headers, stream=True)
+                with response:
+                    if attempt:
+                        response.raise_for_status()
+                        if response.status_code != 206:
+                            offset = 0
+                    if not offset:
+                        expected_size = (
+                            int(response.headers.get("content-length", 0)) or None
+                        )
+                    streamed = bool(extract_dir and not offset)
+                    _write_archive(response, partial_archive, offset, extract_dir)
+
+                offset = os.path.getsize(partial_archive)
+                if expected_size and offset < expected_size:
+                    raise _IncompleteDownloadError(
+                        "Connection closed after {} of {} bytes".format(
+                            offset, expected_size
+                        )
+                    )
+                # only a streamed extraction of the whole archive counts, anything
+                # extracted before a retry is redone from the completed file
+                extracted = streamed
+                break
+            except _DOWNLOAD_ERRORS as exc:
+                if attempt == DOWNLOAD_ATTEMPTS - 1:
+                    raise
+                offset = (
+                    os.path.getsize(partial_archive)
+                    if os.path.exists(partial_archive)
+                    else 0
+                )
+                logger.warning(
+                    "Error fetching %r: %s. Resuming after %d bytes", url, exc, offset
+                )
+    except Exception:
+        if os.path.exists(partial_archive):
+            os.remove(partial_archive)
+        raise
+
+    os.replace(partial_archive, local_archive)
+    if extract_dir and not extracted:
+        _extract_archive(local_archive, extract_dir)
+
+
+def _write_archive(response, partial_archive, offset, extract_dir=None):
+    """Writes a streamed archive response to the partial archive file, appending to it
+    when resuming from an offset.
+    """
+    with open(
+        partial_archive, "ab" if offset else "wb", buffering=ARCHIVE_BUFFER_SIZE
+    ) as file_pointer:
+        if extract_dir and not offset:
+            # extract the archive as it is downloaded instead of reading it back from
+            # disk afterwards
+            stream = _TeeReader(
+                response.raw,
+                file_pointer,
+                int(response.headers.get("content-length", 0)) or None,
+            )
+            with tarfile.open(
+                fileobj=stream, mode="r|*", bufsize=ARCHIVE_BUFFER_SIZE
+            ) as tarball:
+                tarball.copybufsize = ARCHIVE_BUFFER_SIZE
+                tarball.extractall(path=extract_dir)
+        # the tar stream may end before the download does
+        shutil.copyfileobj(response.raw, file_pointer, ARCHIVE_BUFFER_SIZE)
+
+
+def _validate_blueprint_name(name):
+    """Raises a ValueError if the name does not refer to a known blueprint."""
+    if name not in _BLUEPRINT_NAMES:
+        raise ValueError("Unknown blueprint name: {!r}".format(name))
+
+
+def _extract_archive(local_archive, extract_dir):
+    """Extracts a local tar archive into the given directory."""
+    with open(local_archive, "rb", buffering=ARCHIVE_BUFFER_SIZE) as file_pointer:
+        with tarfile.open(fileobj=file_pointer) as tarball:
+            tarball.copybufsize = ARCHIVE_BUFFER_SIZE
+            tarball.extractall(path=extract_dir)
 
 
 blueprint = Blueprint()  # pylint: disable=invalid-name
@@ -334,11 +571,11 @@ def get_pattern(rule):
 def read_path_queries(filepath):
     """Reads queries from given file path.
 
-        Args:
-            filepath (str): File path to read from.
+    Args:
+        filepath (str): File path to read from.
 
-        Returns:
-            queries (list): List of queries.
+    Returns:
+        queries (list): List of queries.
     """
     with open(filepath, "r") as f:
         queries = f.readlines()
@@ -19,6 +19,7 @@ import imp
 import logging
 import os
 import warnings
+from types import MappingProxyType
 
 from .schemas import validate_language_code, validate_locale_code
 from .. import path
@@ -798,18 +799,22 @@ def get_classifier_config(
     return _get_default_classifier_config(clf_type)
 
 
+# Built once rather than on every _get_default_classifier_config call
+_DEFAULT_CLASSIFIER_CONFIGS = MappingProxyType(
+    {
+        "domain": DEFAULT_DOMAIN_CLASSIFIER_CONFIG,
+        "intent": DEFAULT_INTENT_CLASSIFIER_CONFIG,
+        "entity": DEFAULT_ENTITY_RECOGNIZER_CONFIG,
+        "entity_resolution": DEFAULT_ENTITY_RESOLVER_CONFIG,
+        "role": DEFAULT_ROLE_CLASSIFIER_CONFIG,
+        "language_config": DEFAULT_LANGUAGE_CONFIG,
+        "question_answering": DEFAULT_QUESTION_ANSWERER_CONFIG,
+    }
+)
+
+
 def _get_default_classifier_config(clf_type):
-    return copy.deepcopy(
-        {
-            "domain": DEFAULT_DOMAIN_CLASSIFIER_CONFIG,
-            "intent": DEFAULT_INTENT_CLASSIFIER_CONFIG,
-            "entity": DEFAULT_ENTITY_RECOGNIZER_CONFIG,
-            "entity_resolution": DEFAULT_ENTITY_RESOLVER_CONFIG,
-            "role": DEFAULT_ROLE_CLASSIFIER_CONFIG,
-            "language_config": DEFAULT_LANGUAGE_CONFIG,
-            "question_answering": DEFAULT_QUESTION_ANSWERER_CONFIG,
-        }[clf_type]
-    )
+    return copy.deepcopy(_DEFAULT_CLASSIFIER_CONFIGS[clf_type])
 
 
 def get_parser_config(app_path=None, config=None, domain=None, intent=None):
@@ -646,9 +646,13 @@ def load_index(
             )
 
         count = 0
-        # create the progess bar with docs count
+        # create the progess bar with docs count. tqdm gives each concurrently loaded
+        # index its own line, and finished bars are cleared so they don't interleave
+        # with the bars still running
         pbar = tqdm(
-            total=docs_count, desc="Loading Elasticsearch index {}".format(index_name)
+            total=docs_count,
+            desc="Loading Elasticsearch index {}".format(index_name),
+            leave=False,
         )
 
         es_version_7 = is_es_version_7(es_client)
@@ -673,7 +677,12 @@ def load_index(
         pbar.close()
         # Refresh to make sure all data stored is available for search.
         es_client.indices.refresh(index=scoped_index_name)
-        logger.info("Loaded %s document%s", count, "" if count == 1 else "s")
+        logger.info(
+            "Loaded %s document%s into index %r",
+            count,
+            "" if count == 1 else "s",
+            index_name,
+        )
     except _getattr("elasticsearch", "ConnectionError") as e:
         logger.debug(
             "Unable to connect to Elasticsearch: %s details: %s", e.error, e.info
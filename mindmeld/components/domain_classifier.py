@@ -111,8 +111,8 @@ class DomainClassifier(Classifier):
         return (queries.queries(), queries.domains())
 
     def _get_examples_and_labels_hash(self, queries):
-        raw_queries = []
-        for domain, raw_query in zip(queries.domains(), queries.raw_queries()):
-            raw_queries.append(domain + "###" + mark_down(raw_query))
-        raw_queries.sort()
+        raw_queries = sorted(
+            domain + "###" + mark_down(raw_query)
+            for domain, raw_query in zip(queries.domains(), queries.raw_queries())
+        )
         return self._resource_loader.hash_list(raw_queries)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_util
+----------------------------------
+
+Tests for the blueprint helpers in the `_util` module.
+"""
+import io
+import os
+import shutil
+import tarfile
+from email.utils import formatdate
+
+import pytest
+from requests.structures import CaseInsensitiveDict
+from urllib3.exceptions import ProtocolError
+
+from mindmeld import _util, path
+from mindmeld.exceptions import ElasticsearchKnowledgeBaseConnectionError
+
+BLUEPRINT_NAME = "kwik_e_mart"
+LAST_MODIFIED = "Wed, 21 Oct 2015 07:28:00 GMT"
+ARCHIVE_URL = "https://blueprints.mindmeld.com/kwik_e_mart/kb.tar.gz"
+
+
+def make_archive(files):
+    """Builds an in-memory tar.gz archive from a mapping of file names to contents"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tarball:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tarball.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+class FakeRaw(io.BytesIO):
+    """A response body which can drop the connection after a number of bytes"""
+
+    def __init__(self, body, fail_after=None):
+        super().__init__(body)
+        self._fail_after = fail_after
+
+    def read(self, size=-1):
+        if self._fail_after is not None:
+            remaining = self._fail_after - self.tell()
+            if remaining <= 0:
+                raise ProtocolError("Connection broken")
+            if size is None or size < 0 or size > remaining:
+                size = remaining
+        return super().read(size)
+
+
+class FakeResponse:
+    """A minimal stand-in for a streamed requests response"""
+
+    def __init__(self, status_code=200, body=b"", headers=None, fail_after=None):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.raw = FakeRaw(body, fail_after)
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.closed = True
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def blueprint_cache(mocker, tmpdir):
+    cache_dir = str(tmpdir.join("blueprints", BLUEPRINT_NAME))
+    mocker.patch.object(path, "get_cached_blueprint_path", return_value=cache_dir)
+    _util._LAST_MODIFIED_CACHE.clear()
+    yield cache_dir
+    _util._LAST_MODIFIED_CACHE.clear()
+
+
+def test_fetch_archive_not_modified_keeps_cache(mocker, tmpdir, blueprint_cache):
+    archive = make_archive({"app.py": b"cached"})
+    local_archive = os.path.join(blueprint_cache, _util.BLUEPRINT_APP_ARCHIVE)
+    os.makedirs(blueprint_cache)
+    with open(local_archive, "wb") as file_pointer:
+        file_pointer.write(archive)
+    os.utime(local_archive, (1500000000, 1500000000))
+    get = mocker.patch.object(
+        _util._SESSION, "get", return_value=FakeResponse(status_code=304)
+    )
+    extract_dir = str(tmpdir.join("app"))
+
+    assert (
+        _util.Blueprint._fetch_archive(BLUEPRINT_NAME, "app", extract_dir)
+        == local_archive
+    )
+
+    headers = get.call_args[1]["headers"]
+    assert headers["If-Modified-Since"] == formatdate(1500000000, usegmt=True)
+    with open(local_archive, "rb") as file_pointer:
+        assert file_pointer.read() == archive
+    with open(os.path.join(extract_dir, "app.py"), "rb") as file_pointer:
+        assert file_pointer.read() == b"cached"
+
+
+def test_fetch_archive_modified_replaces_cache(mocker, blueprint_cache):
+    local_archive = os.path.join(blueprint_cache, _util.BLUEPRINT_APP_ARCHIVE)
+    os.makedirs(blueprint_cache)
+    with open(local_archive, "wb") as file_pointer:
+        file_pointer.write(make_archive({"app.py": b"old"}))
+    archive = make_archive({"app.py": b"new"})
+    mocker.patch.object(
+        _util._SESSION,
+        "get",
+        return_value=FakeResponse(
+            body=archive, headers={"Content-Length": str(len(archive))}
+        ),
+    )
+
+    _util.Blueprint._fetch_archive(BLUEPRINT_NAME, "app")
+
+    with open(local_archive, "rb") as file_pointer:
+        assert file_pointer.read() == archive
+
+
+def test_fetch_archive_skips_request_within_ttl(mocker, blueprint_cache):
+    archive = make_archive({"app.py": b"app"})
+    get = mocker.patch.object(
+        _util._SESSION,
+        "get",
+        return_value=FakeResponse(
+            body=archive, headers={"Last-Modified": LAST_MODIFIED}
+        ),
+    )
+
+    _util.Blueprint._fetch_archive(BLUEPRINT_NAME, "app")
+    _util.Blueprint._fetch_archive(BLUEPRINT_NAME, "app")
+
+    assert get.call_count == 1
+
+
+def test_fetch_archive_extracts_while_downloading(mocker, tmpdir, blueprint_cache):
+    archive = make_archive(
+        {"app.py": b"app", "domains/store_info/greet/train.txt": b"hi"}
+    )
+    mocker.patch.object(
+        _util._SESSION,
+        "get",
+        return_value=FakeResponse(
+            body=archive, headers={"Content-Length": str(len(archive))}
+        ),
+    )
+    extract_archive = mocker.spy(_util, "_extract_archive")
+    extract_dir = str(tmpdir.join("app"))
+
+    local_archive = _util.Blueprint._fetch_archive(BLUEPRINT_NAME, "app", extract_dir)
+
+    # the archive was extracted from the response stream, not read back from the cache
+    assert not extract_archive.called
+    with open(os.path.join(extract_dir, "app.py"), "rb") as file_pointer:
+        assert file_pointer.read() == b"app"
+    train_file = os.path.join(
+        extract_dir, "domains", "store_info", "greet", "train.txt"
+    )
+    with open(train_file, "rb") as file_pointer:
+        assert file_pointer.read() == b"hi"
+    with open(local_archive, "rb") as file_pointer:
+        assert file_pointer.read() == archive
+
+
+def test_blueprint_sets_up_app_and_kb(mocker, tmpdir, blueprint_cache):
+    archives = {
+        _util.BLUEPRINT_APP_ARCHIVE: make_archive({"app.py": b"app"}),
+        _util.BLUEPRINT_KB_ARCHIVE: make_archive({"stores.json": b"[]"}),
+    }
+
+    def get(url, **kwargs):
+        return FakeResponse(body=archives[url.rsplit("/", 1)[1]])
+
+    mocker.patch.object(_util._SESSION, "get", side_effect=get)
+    load_kb = mocker.patch.object(_util.Blueprint, "_load_kb")
+    app_path = str(tmpdir.join("app"))
+
+    assert _util.blueprint(BLUEPRINT_NAME, app_path) == app_path
+
+    assert os.path.isfile(os.path.join(app_path, "app.py"))
+    assert os.path.isfile(os.path.join(blueprint_cache, "kb", "stores.json"))
+    load_kb.assert_called_once_with(BLUEPRINT_NAME, app_path, None)
+
+
+@pytest.fixture
+def kb_archive():
+    return make_archive({"stores.json": os.urandom(1 << 16)})
+
+
+def test_download_archive_resumes_with_range(mocker, tmpdir, kb_archive):
+    mocker.patch.object(_util.time, "sleep")
+    half = len(kb_archive) // 2
+    response = FakeResponse(
+        body=kb_archive,
+        headers={"Content-Length": str(len(kb_archive)), "ETag": '"v1"'},
+        fail_after=half,
+    )
+    retry = FakeResponse(
+        status_code=206,
+        body=kb_archive[half:],
+        headers={"Content-Length": str(len(kb_archive) - half)},
+    )
+    get = mocker.patch.object(_util._SESSION, "get", return_value=retry)
+    local_archive = str(tmpdir.join("kb.tar.gz"))
+    extract_dir = str(tmpdir.join("kb"))
+
+    _util._download_archive(response, ARCHIVE_URL, local_archive, extract_dir)
+
+    get.assert_called_once_with(
+        ARCHIVE_URL,
+        headers={"Range": "bytes={}-".format(half), "If-Range": '"v1"'},
+        stream=True,
+    )
+    assert retry.closed
+    with open(local_archive, "rb") as file_pointer:
+        assert file_pointer.read() == kb_archive
+    assert not os.path.exists(local_archive + ".part")
+    # the interrupted streaming extraction is redone from the complete archive
+    assert os.path.isfile(os.path.join(extract_dir, "stores.json"))
+
+
+def test_download_archive_restarts_when_range_is_ignored(mocker, tmpdir, kb_archive):
+    mocker.patch.object(_util.time, "sleep")
+    response = FakeResponse(
+        body=kb_archive,
+        headers={"Content-Length": str(len(kb_archive))},
+        fail_after=len(kb_archive) // 2,
+    )
+    retry = FakeResponse(
+        body=kb_archive, headers={"Content-Length": str(len(kb_archive))}
+    )
+    mocker.patch.object(_util._SESSION, "get", return_value=retry)
+    local_archive = str(tmpdir.join("kb.tar.gz"))
+
+    _util._download_archive(response, ARCHIVE_URL, local_archive)
+
+    with open(local_archive, "rb") as file_pointer:
+        assert file_pointer.read() == kb_archive
+
+
+def test_download_archive_removes_partial_file_on_failure(mocker, tmpdir, kb_archive):
+    mocker.patch.object(_util.time, "sleep")
+    half = len(kb_archive) // 2
+    response = FakeResponse(
+        body=kb_archive,
+        headers={"Content-Length": str(len(kb_archive))},
+        fail_after=half,
+    )
+    get = mocker.patch.object(
+        _util._SESSION,
+        "get",
+        side_effect=lambda *args, **kwargs: FakeResponse(
+            status_code=206, body=kb_archive[half:], fail_after=0
+        ),
+    )
+    local_archive = str(tmpdir.join("kb.tar.gz"))
+
+    with pytest.raises(ProtocolError):
+        _util._download_archive(response, ARCHIVE_URL, local_archive)
+
+    assert get.call_count == _util.DOWNLOAD_ATTEMPTS - 1
+    assert not os.path.exists(local_archive + ".part")
+    assert not os.path.exists(local_archive)
+
+
+def test_download_archive_does_not_retry_corrupt_archive(mocker, tmpdir):
+    body = b"not a tar archive" * 100
+    response = FakeResponse(body=body, headers={"Content-Length": str(len(body))})
+    get = mocker.patch.object(_util._SESSION, "get")
+    local_archive = str(tmpdir.join("kb.tar.gz"))
+
+    with pytest.raises(tarfile.ReadError):
+        _util._download_archive(
+            response, ARCHIVE_URL, local_archive, str(tmpdir.join("kb"))
+        )
+
+    assert not get.called
+    assert not os.path.exists(local_archive + ".part")
+
+
+def test_download_archive_resumes_after_early_close(mocker, tmpdir, kb_archive):
+    mocker.patch.object(_util.time, "sleep")
+    half = len(kb_archive) // 2
+    # the connection closes cleanly, so tarfile only sees a truncated archive
+    response = FakeResponse(
+        body=kb_archive[:half], headers={"Content-Length": str(len(kb_archive))}
+    )
+    retry = FakeResponse(status_code=206, body=kb_archive[half:])
+    mocker.patch.object(_util._SESSION, "get", return_value=retry)
+    local_archive = str(tmpdir.join("kb.tar.gz"))
+    extract_dir = str(tmpdir.join("kb"))
+
+    _util._download_archive(response, ARCHIVE_URL, local_archive, extract_dir)
+
+    with open(local_archive, "rb") as file_pointer:
+        assert file_pointer.read() == kb_archive
+    assert os.path.isfile(os.path.join(extract_dir, "stores.json"))
+
+
+def test_download_archive_reextracts_after_close_on_member_boundary(mocker, tmpdir):
+    mocker.patch.object(_util.time, "sleep")
+    files = {"index_{}.json".format(i): os.urandom(100) for i in range(10)}
+    archive = make_archive(files)
+    extract_dir = str(tmpdir.join("kb"))
+    # a clean close can look like the end of the archive to tarfile when the cut lands
+    # on a member boundary, so try every cut point
+    for cut in range(1, len(archive)):
+        response = FakeResponse(
+            body=archive[:cut], headers={"Content-Length": str(len(archive))}
+        )
+        retry = FakeResponse(status_code=206, body=archive[cut:])
+        mocker.patch.object(_util._SESSION, "get", return_value=retry)
+        local_archive = str(tmpdir.join("kb.tar.gz"))
+        shutil.rmtree(extract_dir, ignore_errors=True)
+
+        _util._download_archive(response, ARCHIVE_URL, local_archive, extract_dir)
+
+        assert sorted(os.listdir(extract_dir)) == sorted(files), cut
+
+
+@pytest.fixture
+def kb_dir(blueprint_cache):
+    kb_dir = os.path.join(blueprint_cache, "kb")
+    # subdirectories are not indices and should be skipped
+    os.makedirs(os.path.join(kb_dir, "nested"))
+    for index in ("stores", "products", "recipes"):
+        with open(os.path.join(kb_dir, index + ".json"), "w") as file_pointer:
+            file_pointer.write("[]")
+    return kb_dir
+
+
+@pytest.fixture
+def mock_kb_loading(mocker):
+    from mindmeld.components import QuestionAnswerer
+
+    mocker.patch(
+        "mindmeld.components._config.get_app_namespace", return_value=BLUEPRINT_NAME
+    )
+    es_client = mocker.patch(
+        "mindmeld.components._elasticsearch_helpers.create_es_client"
+    ).return_value
+    load_kb = mocker.patch.object(QuestionAnswerer, "load_kb")
+    return load_kb, es_client
+
+
+def test_load_kb_loads_every_index_once(tmpdir, kb_dir, mock_kb_loading):
+    load_kb, es_client = mock_kb_loading
+    app_path = str(tmpdir.join("app"))
+
+    _util.Blueprint._load_kb(BLUEPRINT_NAME, app_path, "localhost")
+
+    indices = ["products", "recipes", "stores"]
+    assert sorted(os.listdir(os.path.join(app_path, "data"))) == [
+        index + ".json" for index in indices
+    ]
+    assert load_kb.call_count == len(indices)
+    loaded = sorted(call[0][1] for call in load_kb.call_args_list)
+    assert loaded == indices
+    for call in load_kb.call_args_list:
+        assert call[1]["es_client"] is es_client
+
+
+def test_load_kb_raises_connection_error(caplog, tmpdir, kb_dir, mock_kb_loading):
+    load_kb, _ = mock_kb_loading
+
+    def fail_on_products(app_namespace, index_name, *args, **kwargs):
+        if index_name == "products":
+            raise ElasticsearchKnowledgeBaseConnectionError(
+                es_host=[{"host": "localhost"}]
+            )
+
+    load_kb.side_effect = fail_on_products
+
+    with pytest.raises(ElasticsearchKnowledgeBaseConnectionError):
+        _util.Blueprint._load_kb(BLUEPRINT_NAME, str(tmpdir.join("app")), "localhost")
+
+    assert "Cannot set up knowledge base" in caplog.text